@@ -19,6 +19,11 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ###
 
+# Time reference for startup measurements; taken before any other import so
+# that the import cost of all subsystems shows up in --startup-time
+import time
+startup_begin = time.perf_counter()
+
 try:
     # for Python2
     from Tkinter import *   ## notice capitalized T in Tkinter
@@ -28,28 +33,68 @@ except ImportError:
     from tkinter import *   ## notice here too
 from math import log
 import numpy
-import time
+import sys
 
-# Plotting
-import matplotlib.animation as animation
-import matplotlib.pyplot as plot
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-SpectrOMat_animation = None
+# End of the module-level imports for startup measurements
+imports_end = time.perf_counter()
 
-# Audio
-import pygame
+# Plotting; loaded on demand by load_plot()
+animation = None
+plot = None
+FigureCanvasTkAgg = None
+
+# Audio; loaded on demand by load_audio()
+pygame = None
+
+# Snapshot file formats; loaded on demand by load_snapshot_archive()
+snapshot_archive = None
+
+# SeaBreeze USB spectrometer access library; loaded on demand by load_seabreeze()
+sb = None
+
+
+# Lazy subsystem loaders
+def load_plot():
+    """Import the plotting libraries on first use"""
+    global animation, plot, FigureCanvasTkAgg
+    if plot is None:
+        import matplotlib.animation as animation
+        import matplotlib.pyplot as plot
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    return(plot)
+
+
+def load_audio():
+    """Import the audio library on first use"""
+    global pygame
+    if pygame is None:
+        import pygame
+    return(pygame)
 
-# SeaBreeze USB spectrometer access library
-try:
-    import seabreeze
-    seabreeze.use("pyseabreeze")
-    import seabreeze.spectrometers as sb
-except ImportError:
-    # Library not installed
-    sb = None
 
+def load_snapshot_archive():
+    """Import the snapshot file format module on first save"""
+    global snapshot_archive
+    if snapshot_archive is None:
+        import snapshot_archive
+    return(snapshot_archive)
 
-# Global helper function
+
+def load_seabreeze():
+    """Import the SeaBreeze library on first use; None if not installed"""
+    global sb
+    if sb is None:
+        try:
+            import seabreeze
+            seabreeze.use("pyseabreeze")
+            import seabreeze.spectrometers as sb
+        except ImportError:
+            # Library not installed
+            sb = None
+    return(sb)
+
+
+# Global helper functions
 def StringIsInt(s):
     try:
         int(s)
@@ -58,6 +103,15 @@ def StringIsInt(s):
         return False
 
 
+def PositiveInt(s):
+    """argparse type for integers of at least 1"""
+    value = int(s)
+    if value < 1:
+        from argparse import ArgumentTypeError
+        raise ArgumentTypeError('must be at least 1, not ' + str(value))
+    return value
+
+
 # SeaBreeze spectrograph simulator
 class SBSimulator:
     """SeaBreeze specrograph simulator class"""
@@ -97,10 +151,12 @@ class SpectrOMat:
                  autoexposure=False,
                  autorepeat=False,
                  autosave=True,
+                 compress=False,
                  dark_frames=1,
                  device='#0',
                  enable_audio=True,
                  enable_plot=True,
+                 keyframe_interval=64,
                  output_file='Snapshot-%Y-%m-%dT%H:%M:%S%z.dat',
                  root=None,
                  scan_frames=1,
@@ -108,37 +164,54 @@ class SpectrOMat:
                  timestamp='%Y-%m-%dT%H:%M:%S%z',
                  ):
         """Class initializer"""
+        self.startup_times = [('imports', imports_end - startup_begin)]
         self.init_device(device=device)
+        self.mark_startup('device')
         self.init_tk(root=root)
+        self.mark_startup('tk')
         self.init_variables(
                             autoexposure=autoexposure,
                             autorepeat=autorepeat,
                             autosave=autosave,
+                            compress=compress,
                             dark_frames=dark_frames,
                             enable_audio=enable_audio,
                             enable_plot=enable_plot,
+                            keyframe_interval=keyframe_interval,
                             output_file=output_file,
                             scan_frames=scan_frames,
                             scan_time=scan_time,
                             timestamp=timestamp,
                             )
-        self.init_plot()
-        self.init_audio()
+        if enable_plot:
+            self.init_plot()
+            self.mark_startup('plot')
+        if enable_audio:
+            self.init_audio()
+            self.mark_startup('audio')
         self.init_ui()
-                           
+        self.mark_startup('ui')
+
+
+    def mark_startup(self, stage):
+        """Record the time elapsed since the module was loaded for a startup stage"""
+        self.startup_times.append((stage, time.perf_counter() - startup_begin))
+
 
     def init_device(self, device='#0'):
         """Initialize spectrometer device"""
         try:
             if ('SIMULATOR'.startswith(device.upper())):
                 self.spectrometer = SBSimulator()
+            elif (load_seabreeze() is None):
+                raise ImportError
             elif (device[0] == '#'):
                 self.spectrometer = sb.Spectrometer(sb.list_devices()[int(device[1:])])
             else:
                 self.spectrometer = sb.Spectrometer.from_serial_number(device)
         except:
             print('ERROR: Could not initialize device "' + device + '"!')
-            if (sb is None):
+            if (load_seabreeze() is None):
                 print('SeaBreeze library not found!')
             else:
                 print('Available devices:')
@@ -166,9 +239,11 @@ class SpectrOMat:
                        autoexposure=False,
                        autorepeat=False,
                        autosave=True,
+                       compress=False,
                        dark_frames=1,
                        enable_audio=True,
                        enable_plot=True,
+                       keyframe_interval=64,
                        output_file='Snapshot-%Y-%m-%dT%H:%M:%S%z.dat',
                        root=None,
                        scan_frames=1,
@@ -184,6 +259,7 @@ class SpectrOMat:
         self.autoexposure = IntVar(value=autoexposure)
         self.autorepeat = IntVar(value=autorepeat)
         self.autosave = IntVar(value=autosave)
+        self.compress = compress
         self.dark_frames = StringVar(value=dark_frames)
         self.enable_audio = IntVar(value=enable_audio)
         self.enable_plot = IntVar(value=enable_plot)
@@ -191,6 +267,8 @@ class SpectrOMat:
         self.scan_frames = StringVar(value=scan_frames)
         self.scan_time = StringVar(value=scan_time)
         self.timestamp = timestamp
+        self.keyframe_interval = keyframe_interval
+        self.archive = None
 
         self.message = StringVar()
 
@@ -201,16 +279,47 @@ class SpectrOMat:
         self.measurement = 0
         self.data = [0.0]*(self.samplesize)
 
+        # Subsystems are set up on demand
+        self.figure = None
+        self.animation = None
+        self.sound = None
+        self.audio_initialized = False
+
 
     def init_plot(self):
         """Initialize plotting subsystem"""
+        if self.figure is not None:
+            return
+        load_plot()
         self.figure = plot.figure()
         self.axes = self.figure.gca()
         self.graph, = self.axes.plot(self.wavelengths, self.data)
         self.figure.suptitle('No measurement taken so far.')
         self.axes.set_xlabel('Wavelengths [nm]')
         self.axes.set_ylabel('Intensity [count]')
+        if self.have_darkness_correction:
+            self.axes.set_ylabel('Intensity [corrected count]')
         self.canvas = FigureCanvasTkAgg(self.figure, master=self.root)
+        self.animation = animation.FuncAnimation(self.figure, self.update_plot)
+
+
+    def show_plot(self):
+        """Bring up the plotting subsystem and its canvas if not done yet"""
+        if self.figure is None:
+            self.init_plot()
+            self.canvas.get_tk_widget().grid(row=10, columnspan=4)
+
+
+    def toggle_plot(self):
+        """Bring up the plotting subsystem when live plotting is first enabled"""
+        if self.enable_plot.get() > 0:
+            self.show_plot()
+
+
+    def toggle_audio(self):
+        """Bring up the sound subsystem when live audio is first enabled"""
+        if self.enable_audio.get() > 0:
+            self.init_audio()
 
 
     def init_audio(self):
@@ -221,11 +330,13 @@ class SpectrOMat:
         fade = 50           # audio fade-in/fade-out time [ms]
         squelch = 50        # noise-suppression factor
 
-        # Initialize stuff
+        # Initialize stuff; only the mixer is needed, not every pygame subsystem
+        if self.audio_initialized:
+            return
+        load_audio()
         pygame.mixer.pre_init(44100, -16, 1, 1024)
-        pygame.init()
-
-        self.sound = None
+        pygame.mixer.init()
+        self.audio_initialized = True
 
 
     def init_ui(self):
@@ -251,8 +362,8 @@ class SpectrOMat:
         self.button_startpause_text.set(self.button_startpause_texts[self.run_measurement])
         self.button_startpause = Button(self.root, textvariable=self.button_startpause_text, command=self.startpause)
 
-        self.checkbutton_enable_plot = Checkbutton(self.root, text='Enable Live Plotting', variable=self.enable_plot)
-        self.checkbutton_enable_audio = Checkbutton(self.root, text='Enable Live Audio', variable=self.enable_audio)
+        self.checkbutton_enable_plot = Checkbutton(self.root, text='Enable Live Plotting', variable=self.enable_plot, command=self.toggle_plot)
+        self.checkbutton_enable_audio = Checkbutton(self.root, text='Enable Live Audio', variable=self.enable_audio, command=self.toggle_audio)
 
         self.checkbutton_autorepeat = Checkbutton(self.root, text='Auto Repeat', variable=self.autorepeat)
         self.checkbutton_autosave = Checkbutton(self.root, text='Auto Save', variable=self.autosave)
@@ -295,9 +406,10 @@ class SpectrOMat:
         self.button_reset.grid(row=8, column=1, columnspan=2)
         self.button_exit.grid(row=8, column=3)
 
-        self.textbox.grid(columnspan=4)
+        self.textbox.grid(row=9, columnspan=4)
 
-        self.canvas.get_tk_widget().grid(columnspan=4)
+        if self.figure is not None:
+            self.canvas.get_tk_widget().grid(row=10, columnspan=4)
 
 	# Start the infinite measurement loop
         self.root.after(1, self.measure)
@@ -416,27 +528,30 @@ class SpectrOMat:
                 self.root.update()
             self.darkness_correction = list(map(lambda x:x/count, newData))
             self.have_darkness_correction = True
-            self.axes.set_ylabel('Intensity [corrected count]')
+            if self.figure is not None:
+                self.axes.set_ylabel('Intensity [corrected count]')
             self.message.set(str(self.dark_frames.get()) + ' dark frames scanned. Ready.')
             print(str(self.dark_frames.get()) + ' dark frames scanned.')
 
 
+    def snapshot_metadata(self):
+        """Describe the current snapshot for the snapshot file formats"""
+        return({
+                'time': time.strftime(self.timestamp, time.gmtime()),
+                'frames': self.measurement,
+                'scan_time': self.scan_time.get(),
+                'dark_frames': self.dark_frames.get() if self.have_darkness_correction else None,
+                })
+
+
     def save(self):
+        load_snapshot_archive()
+        if self.compress:
+            self.save_compressed()
+            return
         try:
             with open(time.strftime('Snapshot-%Y-%m-%dT%H:%M:%S.dat', time.gmtime()), 'w') as f:
-                f.write('# Spectr-O-Mat data format: 2')
-                f.write('\n# Time of snapshot: ' + time.strftime(self.timestamp, time.gmtime()))
-                f.write('\n# Number of frames accumulated: ' + str(self.measurement))
-                f.write('\n# Scan time per exposure [µs]: ' + str(self.scan_time.get()))
-                if self.have_darkness_correction:
-                    f.write('\n# Number of dark frames accumulated: ' + str(self.dark_frames.get()))
-                    f.write('\n# Wavelength [nm], dark frame correction data [averaged count]:\n# ')
-                    f.write('\n# '.join(map(lambda x,y:str(x)+', '+str(y), self.spectrometer.wavelengths(), self.darkness_correction)))
-                    f.write('\n# Wavelength [nm], Intensity [corrected count]:\n')
-                else:
-                    f.write('\n# Number of dark frames accumulated: None.')
-                    f.write('\n# Wavelength [nm], Intensity [count]:\n')
-                f.write('\n'.join(map(lambda x,y:str(x)+', '+str(y), self.spectrometer.wavelengths(), self.data)) + '\n')
+                snapshot_archive.write_dat(f, self.spectrometer.wavelengths(), self.snapshot_metadata(), self.darkness_correction, self.data)
             self.message.set('Data saved to ' + time.strftime('Snapshot-%Y-%m-%dT%H:%M:%S.dat', time.gmtime()) + '. Ready.')
             print('Data saved to ' + time.strftime('Snapshot-%Y-%m-%dT%H:%M:%S.dat', time.gmtime()))
         except:
@@ -445,24 +560,75 @@ class SpectrOMat:
         self.root.update()
 
 
+    def open_archive(self):
+        """Start a new compressed run file without touching existing ones"""
+        name = time.strftime('Snapshot-%Y-%m-%dT%H:%M:%S', time.gmtime())
+        suffix = ''
+        count = 0
+        while True:
+            try:
+                return(snapshot_archive.SnapshotWriter(name + suffix + '.somz',
+                                                       self.spectrometer.wavelengths(),
+                                                       keyframe_interval=self.keyframe_interval))
+            except FileExistsError:
+                count += 1
+                suffix = '-' + str(count)
+
+
+    def save_compressed(self):
+        """Append the current snapshot to the compressed run file"""
+        load_snapshot_archive()
+        try:
+            if self.archive is None:
+                self.archive = self.open_archive()
+            self.archive.write(self.darkness_correction, self.data, **self.snapshot_metadata())
+            # Cycles are numbered from 0, as in snapshot_archive.py
+            cycle = str(self.archive.cycles - 1)
+            self.message.set('Cycle ' + cycle + ' saved to ' + self.archive.filename + '. Ready.')
+            print('Cycle ' + cycle + ' saved to ' + self.archive.filename)
+        except Exception as error:
+            self.message.set('Error while writing compressed run file: ' + str(error) + '. Ready.')
+            print('Error while writing compressed run file:', error)
+            # Never append after a partial record; the next save starts a new file
+            try:
+                self.close_archive()
+            except OSError:
+                pass
+        self.root.update()
+
+
+    def close_archive(self):
+        """Finish the current compressed run file; the next save starts a new one"""
+        if self.archive is not None:
+            try:
+                self.archive.close()
+            finally:
+                self.archive = None
+
+
     def reset(self):
+        self.close_archive()
         self.run_measurement = False
         self.button_startpause_text.set(self.button_startpause_texts[self.run_measurement])
         self.button_stopdarkness_text.set(self.button_stopdarkness_texts[self.run_measurement])
         self.darkness_correction = [0.0]*(len(self.spectrometer.wavelengths()))
         self.have_darkness_correction = False
         self.data = [0.0]*(len(self.spectrometer.wavelengths()))
-        self.figure.suptitle('No measurement taken so far.')
-        self.axes.set_ylabel('Intensity [count]')
+        if self.figure is not None:
+            self.figure.suptitle('No measurement taken so far.')
+            self.axes.set_ylabel('Intensity [count]')
         self.measurement = 0
         self.message.set('All parameters reset. Ready.')
 
 
     def exit(self):
+        self.close_archive()
         sys.exit(0)
 
 
     def update_plot(self, i):
+        if self.figure is None:
+            return
         scan_frames = int(self.scan_frames.get())
         if (self.measurement == scan_frames) or \
            (self.enable_plot.get() > 0):
@@ -486,9 +652,13 @@ class SpectrOMat:
                 self.data = list(map(lambda x,y:x+y, self.data, newData))
             self.measurement += 1
 
-            plot.suptitle(time.strftime(self.timestamp, time.gmtime()) +
-                         ' (sum of ' + str(self.measurement) + ' measurement(s)' +
-                         ' with scan time ' + str(self.scan_time.get()) + ' µs)')
+            if scan_frames > 0 and self.measurement % scan_frames == 0:
+                # The result of a cycle is always plotted, even without live plotting
+                self.show_plot()
+            if self.figure is not None:
+                self.figure.suptitle(time.strftime(self.timestamp, time.gmtime()) +
+                                     ' (sum of ' + str(self.measurement) + ' measurement(s)' +
+                                     ' with scan time ' + str(self.scan_time.get()) + ' µs)')
 
             if (self.measurement % 100 == 0):
                 print('O', end='', flush=True)
@@ -511,10 +681,29 @@ class SpectrOMat:
         self.root.after(1, self.measure)
 
 
-def main(device='#0', scan_time=100000, scan_frames=1, timestamp='%Y-%m-%dT%H:%M:%S%z'):
-    spectromat = SpectrOMat(device=device, scan_time=scan_time, scan_frames=scan_frames, timestamp=timestamp)
-    SpectrOMat_animation = animation.FuncAnimation(spectromat.figure, spectromat.update_plot)
+def main(device='#0', scan_time=100000, scan_frames=1, timestamp='%Y-%m-%dT%H:%M:%S%z', enable_audio=True, enable_plot=True, compress=False, keyframe_interval=64):
+    spectromat = SpectrOMat(device=device, scan_time=scan_time, scan_frames=scan_frames, timestamp=timestamp, enable_audio=enable_audio, enable_plot=enable_plot, compress=compress, keyframe_interval=keyframe_interval)
     spectromat.root.mainloop()
+    spectromat.close_archive()
+
+
+def startup_time(device='#0', scan_time=100000, scan_frames=1, timestamp='%Y-%m-%dT%H:%M:%S%z', enable_audio=True, enable_plot=True):
+    """Measure the time from loading this module until the first frame has
+    gone through one regular measurement cycle; nothing is saved"""
+    spectromat = SpectrOMat(device=device, scan_time=scan_time, scan_frames=scan_frames, timestamp=timestamp, enable_audio=enable_audio, enable_plot=enable_plot)
+    spectromat.autosave.set(0)
+    spectromat.root.update()
+    spectromat.mark_startup('window')
+    spectromat.startpause()
+    spectromat.measure()
+    spectromat.mark_startup('first frame')
+    print('Startup time [s]:')
+    previous = 0.0
+    for stage, elapsed in spectromat.startup_times:
+        print(' - {:<12} {:8.3f} (+{:.3f})'.format(stage + ':', elapsed, elapsed - previous))
+        previous = elapsed
+    spectromat.root.destroy()
+
 
 if __name__ == "__main__":
     # Print license info
@@ -532,6 +721,14 @@ under certain conditions; refer to LICENSE for details.
     parser.add_argument('-r', '--scan_frames', dest='scan_frames', default='1', help='reset after n measurement cycles with 0 meaning indefinite (default: 1)')
     parser.add_argument('-s', '--scan_time', dest='scan_time', default='100000', help='scan time in microseconds (default: 100000)')
     parser.add_argument('-t', '--timestamp',  dest='timestamp', default='%Y-%m-%dT%H:%M:%S%z', help='itemstamp format string (default: "%%Y-%%m-%%dT%%H:%%M:%%S%%z")')
+    parser.add_argument('-A', '--no-audio', dest='enable_audio', action='store_false', help='start with live audio disabled; the sound subsystem is not loaded until enabled')
+    parser.add_argument('-P', '--no-plot', dest='enable_plot', action='store_false', help='start with live plotting disabled; the plotting subsystem is not loaded until enabled or until the first measurement cycle completes, whose result is always plotted')
+    parser.add_argument('-z', '--compress', dest='compress', action='store_true', help='save snapshots of a run into one compressed, delta-encoded .somz file; read it with snapshot_archive.py')
+    parser.add_argument('-k', '--keyframe-interval', dest='keyframe_interval', type=PositiveInt, default=64, help='store a full keyframe every n cycles in compressed mode (default: 64)')
+    parser.add_argument('--startup-time', dest='startup_time', action='store_true', help='measure the time from loading the program until one regular measurement cycle has acquired its first frame, then exit; autosave is turned off, so no data files are written')
     args = parser.parse_args()
 
-    main(args.device, args.scan_time, args.scan_frames, args.timestamp)
+    if args.startup_time:
+        startup_time(args.device, args.scan_time, args.scan_frames, args.timestamp, args.enable_audio, args.enable_plot)
+    else:
+        main(args.device, args.scan_time, args.scan_frames, args.timestamp, args.enable_audio, args.enable_plot, args.compress, args.keyframe_interval)
@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###
+# Compressed, delta-encoded storage of SpectrOMat snapshot runs.
+# Copyright (C) 2017-2020 Tobias Dussa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###
+
+# File layout:
+#   magic 'SOMZ' + format version byte, then a sequence of records.
+#   Each record is a header (kind, metadata length, payload length), UTF-8
+#   JSON metadata and a zlib-compressed payload.
+#   - 'W' record: the wavelength column, stored once per run in its original
+#     dtype (given in the metadata) so integer wavelengths stay integers.
+#   - 'K' record (keyframe): dark correction and intensities of one cycle.
+#   - 'D' record (delta): the same, XORed bitwise against the previous cycle.
+# All vectors are float64; XOR on the bit patterns keeps the encoding
+# lossless while turning unchanged values (wavelengths, dark block) into
+# zeros.  Bytes are shuffled by significance before compression so that the
+# mostly-identical high-order bytes end up next to each other.
+
+import json
+import struct
+import sys
+import zlib
+
+import numpy
+
+MAGIC = b'SOMZ'
+VERSION = 1
+RECORD_HEADER = struct.Struct('<cII')
+
+
+def _encode(vector):
+    """Byte-shuffle a vector and compress it"""
+    shuffled = vector.view(numpy.uint8).reshape(-1, vector.dtype.itemsize).T.copy()
+    return(zlib.compress(shuffled.tobytes(), 1))
+
+
+def _decode(payload, dtype=numpy.uint64):
+    """Decompress and unshuffle a vector"""
+    dtype = numpy.dtype(dtype)
+    shuffled = numpy.frombuffer(zlib.decompress(payload), dtype=numpy.uint8)
+    return(shuffled.reshape(dtype.itemsize, -1).T.copy().view(dtype).ravel())
+
+
+class SnapshotWriter:
+    """Append snapshot cycles to a compressed run file"""
+
+    def __init__(self, filename, wavelengths, keyframe_interval=64):
+        """Create a new run file; an existing file is never overwritten"""
+        if keyframe_interval < 1:
+            raise ValueError('keyframe interval must be at least 1, not ' + str(keyframe_interval))
+        self.filename = filename
+        self.keyframe_interval = keyframe_interval
+        self.cycles = 0
+        self.previous = None
+        wavelengths = numpy.asarray(wavelengths)
+        self.file = open(filename, 'xb')
+        self.file.write(MAGIC + bytes([VERSION]))
+        self._write_record(b'W', {'dtype': wavelengths.dtype.str}, wavelengths)
+
+    def _write_record(self, kind, metadata, vector):
+        metadata = json.dumps(metadata).encode('utf-8')
+        payload = _encode(vector)
+        self.file.write(RECORD_HEADER.pack(kind, len(metadata), len(payload)))
+        self.file.write(metadata)
+        self.file.write(payload)
+        self.file.flush()
+
+    def write(self, darkness_correction, data, **metadata):
+        """Append one cycle; metadata is stored verbatim alongside it"""
+        darkness_correction = numpy.asarray(darkness_correction, dtype=numpy.float64)
+        vector = numpy.concatenate([darkness_correction, numpy.asarray(data, dtype=numpy.float64)]).view(numpy.uint64)
+        metadata['samples'] = len(darkness_correction)
+        if self.previous is None or \
+           len(self.previous) != len(vector) or \
+           self.cycles % self.keyframe_interval == 0:
+            self._write_record(b'K', metadata, vector)
+        else:
+            self._write_record(b'D', metadata, vector ^ self.previous)
+        self.previous = vector
+        self.cycles += 1
+
+    def close(self):
+        self.file.close()
+
+
+class SnapshotReader:
+    """Random access to the cycles of a compressed run file"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        if self.file.read(len(MAGIC) + 1) != MAGIC + bytes([VERSION]):
+            raise ValueError(filename + ' is not a Spectr-O-Mat compressed run file')
+        self.wavelengths = None
+        self.index = []
+        self._cached = None
+        self._scan()
+
+    def _scan(self):
+        """Index all records by reading their headers only"""
+        size = self.file.seek(0, 2)
+        self.file.seek(len(MAGIC) + 1)
+        while True:
+            header = self.file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            kind, metadata_length, payload_length = RECORD_HEADER.unpack(header)
+            metadata = self.file.read(metadata_length)
+            offset = self.file.tell()
+            if len(metadata) < metadata_length or \
+               size < offset + payload_length:
+                # Truncated final record, e.g. after a crash
+                break
+            self.file.seek(offset + payload_length)
+            if kind == b'W':
+                self.file.seek(offset)
+                dtype = json.loads(metadata.decode('utf-8')).get('dtype', '<f8')
+                self.wavelengths = _decode(self.file.read(payload_length), dtype)
+                continue
+            self.index.append((kind, json.loads(metadata.decode('utf-8')), offset, payload_length))
+
+    def __len__(self):
+        return(len(self.index))
+
+    def _vector(self, cycle):
+        kind, metadata, offset, length = self.index[cycle]
+        self.file.seek(offset)
+        return(_decode(self.file.read(length)))
+
+    def metadata(self, cycle):
+        return(dict(self.index[cycle][1]))
+
+    def read(self, cycle):
+        """Return (metadata, darkness correction, data) of a cycle"""
+        if cycle < 0:
+            cycle += len(self.index)
+        if cycle < 0 or cycle >= len(self.index):
+            raise IndexError('cycle out of range')
+        # Start from the cached cycle if it lies between the keyframe and the target
+        start = cycle
+        while self.index[start][0] != b'K':
+            start -= 1
+        if self._cached is not None and start <= self._cached[0] <= cycle:
+            start, vector = self._cached
+        else:
+            vector = self._vector(start)
+        for position in range(start + 1, cycle + 1):
+            vector = vector ^ self._vector(position)
+        self._cached = (cycle, vector)
+        metadata = self.metadata(cycle)
+        values = vector.view(numpy.float64)
+        samples = metadata['samples']
+        return(metadata, values[:samples], values[samples:])
+
+    def close(self):
+        self.file.close()
+
+
+def write_dat(handle, wavelengths, metadata, darkness_correction, data):
+    """Write a cycle in the plain-text snapshot format"""
+    handle.write('# Spectr-O-Mat data format: 2')
+    handle.write('\n# Time of snapshot: ' + metadata['time'])
+    handle.write('\n# Number of frames accumulated: ' + str(metadata['frames']))
+    handle.write('\n# Scan time per exposure [µs]: ' + str(metadata['scan_time']))
+    if metadata['dark_frames'] is not None:
+        handle.write('\n# Number of dark frames accumulated: ' + str(metadata['dark_frames']))
+        handle.write('\n# Wavelength [nm], dark frame correction data [averaged count]:\n# ')
+        handle.write('\n# '.join(map(lambda x,y:str(x)+', '+str(y), wavelengths, darkness_correction)))
+        handle.write('\n# Wavelength [nm], Intensity [corrected count]:\n')
+    else:
+        handle.write('\n# Number of dark frames accumulated: None.')
+        handle.write('\n# Wavelength [nm], Intensity [count]:\n')
+    handle.write('\n'.join(map(lambda x,y:str(x)+', '+str(y), wavelengths, data)) + '\n')
+
+
+if __name__ == "__main__":
+    # Print license info
+    print('''
+SpectrOMat snapshot_archive Copyright (C) 2017-2020 Tobias Dussa
+This program comes with ABSOLUTELY NO WARRANTY; for details see LICENSE.
+This is free software, and you are welcome to redistribute it
+under certain conditions; refer to LICENSE for details.
+    ''', file=sys.stderr);
+
+    # Parse args
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='Extract cycles from a compressed Spectr-O-Mat run file.')
+    parser.add_argument('run_file', help='compressed run file (.somz)')
+    parser.add_argument('cycle', nargs='?', type=int, help='cycle to extract as plain-text snapshot; negative values count from the end (default: list cycles)')
+    args = parser.parse_args()
+
+    reader = SnapshotReader(args.run_file)
+    if args.cycle is None:
+        for cycle in range(len(reader)):
+            metadata = reader.metadata(cycle)
+            print(str(cycle) + ': ' + metadata['time'] + ', ' + str(metadata['frames']) + ' frame(s)')
+    else:
+        metadata, darkness_correction, data = reader.read(args.cycle)
+        write_dat(sys.stdout, reader.wavelengths, metadata, darkness_correction, data)
+    reader.close()
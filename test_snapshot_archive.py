@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+###
+# Tests for the compressed SpectrOMat snapshot run format.
+# Copyright (C) 2017-2020 Tobias Dussa
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+###
+
+import io
+
+import numpy
+import pytest
+
+import snapshot_archive
+
+wavelengths = list(range(2048))
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Write a run of 20 noisy cycles with a keyframe every 8 cycles"""
+    generator = numpy.random.default_rng(0)
+    darkness_correction = generator.normal(100, 3, len(wavelengths))
+    base = generator.poisson(1000, len(wavelengths)).astype(numpy.float64)
+    cycles = [base + generator.normal(0, 5, len(wavelengths)) for cycle in range(20)]
+    filename = str(tmp_path / 'run.somz')
+    writer = snapshot_archive.SnapshotWriter(filename, wavelengths, keyframe_interval=8)
+    for cycle, data in enumerate(cycles):
+        writer.write(darkness_correction, data, time=str(cycle), frames=1, scan_time=100000, dark_frames=1)
+    writer.close()
+    return(filename, darkness_correction, cycles)
+
+
+def test_keyframe_interval_must_be_positive(tmp_path):
+    with pytest.raises(ValueError):
+        snapshot_archive.SnapshotWriter(str(tmp_path / 'run.somz'), wavelengths, keyframe_interval=0)
+
+
+def test_existing_run_file_is_not_overwritten(run):
+    filename = run[0]
+    with pytest.raises(FileExistsError):
+        snapshot_archive.SnapshotWriter(filename, wavelengths)
+
+
+def test_round_trip_random_access(run):
+    filename, darkness_correction, cycles = run
+    reader = snapshot_archive.SnapshotReader(filename)
+    assert len(reader) == len(cycles)
+    assert list(reader.wavelengths) == wavelengths
+    # Out of order, so that both fresh keyframe decoding and the cache are used
+    for cycle in [19, 3, 4, 17, 0, -1, 9, 8, 15]:
+        metadata, darkness, data = reader.read(cycle)
+        assert numpy.array_equal(darkness, darkness_correction)
+        assert numpy.array_equal(data, cycles[cycle])
+        assert metadata['time'] == str(cycle % len(cycles))
+    with pytest.raises(IndexError):
+        reader.read(len(cycles))
+    reader.close()
+
+
+def test_integer_wavelengths_in_text_output(run):
+    reader = snapshot_archive.SnapshotReader(run[0])
+    text = io.StringIO()
+    snapshot_archive.write_dat(text, reader.wavelengths, *reader.read(0))
+    reader.close()
+    assert '\n0, ' in text.getvalue()
+    assert '\n0.0, ' not in text.getvalue()
+
+
+def test_truncated_final_record_is_skipped(run):
+    filename, darkness_correction, cycles = run
+    with open(filename, 'rb') as f:
+        contents = f.read()
+    with open(filename, 'wb') as f:
+        f.write(contents[:-10])
+    reader = snapshot_archive.SnapshotReader(filename)
+    assert len(reader) == len(cycles) - 1
+    assert numpy.array_equal(reader.read(-1)[2], cycles[-2])
+    reader.close()
+
+
+def test_not_a_run_file(tmp_path):
+    filename = tmp_path / 'Snapshot.dat'
+    filename.write_text('# Spectr-O-Mat data format: 2\n')
+    with pytest.raises(ValueError):
+        snapshot_archive.SnapshotReader(str(filename))